@@ -0,0 +1,139 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import StructuredTool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "trigger_setup"))
+
+import session_manager  # noqa: E402
+from agent import run_agent  # noqa: E402
+
+
+class ToolCallingFakeModel(FakeMessagesListChatModel):
+    """Scripted chat model that create_react_agent can bind tools to."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def tool_call(call_id: str) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": "search", "args": {}, "id": call_id}])
+
+
+class FakeComposioClient:
+    """Hands out a new Tool Router session URL on every create."""
+
+    def __init__(self):
+        self.created = []
+
+    def create(self, user_id: str):
+        url = f"https://mcp.example.com/session/{len(self.created)}"
+        self.created.append(url)
+        return SimpleNamespace(mcp=SimpleNamespace(url=url, headers={}))
+
+
+class FakeMCPClient:
+    """Serves one `search` tool whose behaviour depends on the session URL."""
+
+    failures = {}
+
+    def __init__(self, connections):
+        self.url = connections["composio"]["url"]
+
+    async def get_tools(self):
+        url = self.url
+
+        async def search() -> str:
+            error = self.failures.get(url)
+            if error is not None:
+                raise error(url)
+            return f"results from {url}"
+
+        return [StructuredTool.from_function(coroutine=search, name="search", description="Search.")]
+
+
+def session_rejected(url: str) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", url)
+    response = httpx.Response(401, request=request)
+    return httpx.HTTPStatusError("Unauthorized", request=request, response=response)
+
+
+class RunWithGraphTest(unittest.IsolatedAsyncioTestCase):
+
+    def make_manager(self, responses):
+        self.composio = FakeComposioClient()
+        self.llm = ToolCallingFakeModel(responses=responses)
+        patches = [
+            mock.patch.object(session_manager, "initialise_composio_client", return_value=self.composio),
+            mock.patch.object(session_manager, "initialise_chatmodel", return_value=self.llm),
+            mock.patch.object(session_manager, "MultiServerMCPClient", FakeMCPClient),
+            mock.patch.object(FakeMCPClient, "failures", {}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return session_manager.SessionManager()
+
+    async def test_rejected_session_is_rebuilt_and_retried(self):
+        manager = self.make_manager([tool_call("1"), tool_call("2"), AIMessage(content="done")])
+        FakeMCPClient.failures["https://mcp.example.com/session/0"] = session_rejected
+        messages = [HumanMessage(content="find it")]
+
+        result_messages, response = await manager.run_with_graph(
+            "user", lambda graph, progress: run_agent(graph, messages, progress)
+        )
+
+        self.assertEqual(response, "done")
+        self.assertEqual(len(self.composio.created), 2)
+        self.assertEqual(result_messages[1].content, "results from https://mcp.example.com/session/1")
+        self.assertEqual(
+            (await manager.create_session_and_graph("user"))["mcp_url"],
+            "https://mcp.example.com/session/1",
+        )
+
+    async def test_other_tool_errors_are_reported_to_the_model(self):
+        manager = self.make_manager([tool_call("1"), AIMessage(content="done")])
+        FakeMCPClient.failures["https://mcp.example.com/session/0"] = ValueError
+        messages = [HumanMessage(content="find it")]
+
+        result_messages, response = await manager.run_with_graph(
+            "user", lambda graph, progress: run_agent(graph, messages, progress)
+        )
+
+        self.assertEqual(response, "done")
+        self.assertEqual(len(self.composio.created), 1)
+        self.assertEqual(result_messages[1].status, "error")
+
+
+class GraphCacheTest(unittest.TestCase):
+
+    def test_entries_expire_at_max_age_even_when_hit(self):
+        with mock.patch.object(session_manager, "initialise_composio_client"), \
+                mock.patch.object(session_manager, "initialise_chatmodel"):
+            manager = session_manager.SessionManager()
+
+        clock = mock.patch.object(session_manager.time, "monotonic", return_value=0.0)
+        monotonic = clock.start()
+        self.addCleanup(clock.stop)
+
+        manager._store("user", {"mcp_url": "https://mcp.example.com/session/0"})
+        step = session_manager.GRAPH_CACHE_IDLE_TTL_SECONDS / 2
+        now = 0.0
+        while now + step < session_manager.GRAPH_CACHE_MAX_AGE_SECONDS:
+            now += step
+            monotonic.return_value = now
+            self.assertIsNotNone(manager._get_cached("user"))
+
+        monotonic.return_value = session_manager.GRAPH_CACHE_MAX_AGE_SECONDS
+        self.assertIsNone(manager._get_cached("user"))
+        self.assertNotIn("user", manager._graph_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
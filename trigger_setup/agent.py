@@ -1,20 +1,113 @@
-import json
 import asyncio
+import concurrent.futures
+import logging
 import os
+import queue
+import threading
+from typing import Optional
+from logging.handlers import QueueHandler, QueueListener
+import orjson
 from langchain_core.messages import HumanMessage
 from constants import initialise_composio_client
-from email_handler import get_email_handler
+from email_handler import get_email_handler, parse_sender_email
 from context_manager import get_context_manager
-from session_manager import get_session_manager
+from database import get_conversation_store
+from session_manager import get_session_manager, RunProgress
+from utils import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# This app's module loggers, which get LOG_LEVEL
+APP_LOGGERS = (__name__, "session_manager", "email_handler", "context_manager", "database")
+
+# How long Ctrl+C waits for running triggers, and then for queued DB writes
+SHUTDOWN_TIMEOUT_SECONDS = 30
+
+
+def configure_logging() -> QueueListener:
+    """
+    Send log records through a queue to a listener thread that writes them out,
+    so logging from the event loop never blocks on stdout.
+
+    LOG_LEVEL applies to this app's modules only; third-party libraries
+    (httpx, openai, mcp, ...) stay at WARNING.
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.WARNING)
+
+    app_level = os.getenv("LOG_LEVEL", "INFO").upper()
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(app_level)
+
+    log_listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    log_listener.start()
+    return log_listener
+
+
+async def run_agent(graph, messages: list, progress: Optional[RunProgress] = None) -> tuple[list, str]:
+    """Stream the agent over messages, returning the new messages and the final response."""
+    result_messages = []
+    agent_response = ""
+
+    async for event in graph.astream_events({"messages": messages}, version="v2"):
+        kind = event["event"]
+
+        if kind == "on_chat_model_end":
+            # The last model turn of the ReAct loop is the final assistant message
+            msg = event["data"]["output"]
+            agent_response = msg.content
+            if msg.content:
+                logger.info("💬 Agent: %s...", msg.content[:500])
+        elif kind == "on_tool_end":
+            if progress is not None:
+                progress.tool_calls_completed += 1
+            output = event["data"].get("output")
+            content = getattr(output, 'content', output)
+            if content:
+                logger.info("💬 Agent: %s...", str(content)[:500])
+        elif kind == "on_chain_end" and not event["parent_ids"]:
+            # Root graph finished: its output state holds the input plus every new message
+            result_messages = event["data"]["output"]["messages"][len(messages):]
+
+    return result_messages, agent_response
+
+
+async def send_reply(email_handler, email_data: dict, agent_response: str):
+    """Send the agent's response as a reply, logging rather than raising on failure."""
+    logger.info("📧 Sending reply...")
+    try:
+        await run_blocking(
+            email_handler.send_reply,
+            connected_account_id=email_data.get('connected_account_id'),
+            thread_id=email_data['thread_id'],
+            recipient_email=email_data['sender_email'],
+            message_body=agent_response
+        )
+    except Exception as reply_error:
+        logger.error("❌ Failed to send reply: %s", reply_error)
+        logger.error("   Continuing without sending reply...")
 
 
 async def process_email_trigger(trigger_data: dict):
     """Process incoming email trigger from Composio."""
     try:
-        print("\n" + "="*80)
-        print("📧 NEW EMAIL TRIGGER RECEIVED")
-        print("="*80)
-        print(json.dumps(trigger_data, indent=2))
+        # Drop self-emails before parsing the payload or touching the DB and sessions
+        sender_email = parse_sender_email(trigger_data.get("payload", {}).get("sender", ""))
+        inbox_owner_email = os.getenv('GMAIL_USER_ID', '').lower()
+        if inbox_owner_email and sender_email.lower() == inbox_owner_email:
+            logger.info("⚠️ Skipping - email is from assistant itself (avoiding loop)")
+            return
+
+        logger.info("="*80)
+        logger.info("📧 NEW EMAIL TRIGGER RECEIVED")
+        logger.info("="*80)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(orjson.dumps(trigger_data, option=orjson.OPT_INDENT_2).decode())
 
         email_handler = get_email_handler()
         context_manager = get_context_manager()
@@ -24,77 +117,46 @@ async def process_email_trigger(trigger_data: dict):
         user_id = email_data['sender_email']
         thread_id = email_data['thread_id']
 
-        print(f"\n📨 From: {email_data['sender_email']}")
-        print(f"📋 Subject: {email_data['subject']}")
-        print(f"🧵 Thread ID: {thread_id}")
-        print(f"📝 Body Preview: {email_data['body'][:200]}...")
-
-        inbox_owner_email = os.getenv('GMAIL_USER_ID', '').lower()
-        if inbox_owner_email and user_id.lower() == inbox_owner_email:
-            print(f"⚠️ Skipping - email is from assistant itself (avoiding loop)")
-            return
+        logger.info("📨 From: %s", email_data['sender_email'])
+        logger.info("📋 Subject: %s", email_data['subject'])
+        logger.info("🧵 Thread ID: %s", thread_id)
+        logger.info("📝 Body Preview: %s...", email_data['body'][:200])
 
-        print(f"\n📚 Loading conversation history...")
-        message_history = context_manager.load_conversation_context(user_id, thread_id)
-        print(f"✅ Loaded {len(message_history)} previous messages")
-
-        print(f"\n🔧 Creating Tool Router session...")
-        session_data = await session_manager.create_session_and_graph(user_id)
-        graph = session_data['graph']
+        logger.info("📚 Loading conversation history...")
+        message_history = await context_manager.load_conversation_context(user_id, thread_id)
+        logger.info("✅ Loaded %d previous messages", len(message_history))
 
         full_email_content = f"Subject: {email_data['subject']}\n\nFrom: {email_data['sender_email']}\n\n{email_data['body']}"
         new_message = HumanMessage(content=f"Process this email and execute the instructions:\n\n{full_email_content}")
+        # The loader returns a fresh list, so append in place instead of copying the history
+        message_history.append(new_message)
+
+        logger.info("🤖 Running agent workflow...")
+        result_messages, agent_response = await session_manager.run_with_graph(
+            user_id, lambda graph, progress: run_agent(graph, message_history, progress)
+        )
 
-        print(f"\n🤖 Running agent workflow...")
-        current_messages = message_history + [new_message]
-        result_messages = []
-        agent_response = ""
-
-        async for event in graph.astream({"messages": current_messages}):
-            for value in event.values():
-                if "messages" in value and value["messages"]:
-                    for msg in value["messages"]:
-                        result_messages.append(msg)
-                        current_messages.append(msg)
-
-                        if hasattr(msg, 'content') and msg.content:
-                            print(f"\n💬 Agent: {msg.content[:500]}...")
-                            if not hasattr(msg, 'tool_calls') or not msg.tool_calls:
-                                agent_response = msg.content
-
-        print(f"\n💾 Saving conversation to database...")
-        context_manager.save_conversation_context(
+        # Save and reply concurrently, so the reply doesn't wait on the DB commit
+        logger.info("💾 Saving conversation to database...")
+        save_task = asyncio.create_task(context_manager.save_conversation_context(
             user_id=user_id,
             thread_id=thread_id,
             sender_email=email_data['sender_email'],
-            messages=current_messages
-        )
-
-        print(f"\n✅ Email processed successfully!")
-        print(f"🔨 Actions taken: {len([m for m in result_messages if hasattr(m, 'tool_calls') and m.tool_calls])}")
-        print("="*80 + "\n")
+            new_messages=[new_message] + result_messages
+        ))
 
         if thread_id and agent_response:
-            print(f"📧 Sending reply...")
-            connected_account_id = email_data.get('connected_account_id')
-
-            try:
-                email_handler.send_reply(
-                    connected_account_id=connected_account_id,
-                    thread_id=thread_id,
-                    recipient_email=email_data['sender_email'],
-                    message_body=agent_response
-                )
-            except Exception as reply_error:
-                print(f"❌ Failed to send reply: {reply_error}")
-                print(f"   Continuing without sending reply...")
+            await asyncio.gather(save_task, send_reply(email_handler, email_data, agent_response))
         else:
-            print(f"⚠️ Skipping reply - No thread_id or response")
+            logger.info("⚠️ Skipping reply - No thread_id or response")
+            await save_task
+
+        logger.info("✅ Email processed successfully!")
+        logger.info("🔨 Actions taken: %d", len([m for m in result_messages if hasattr(m, 'tool_calls') and m.tool_calls]))
+        logger.info("="*80)
 
     except Exception as e:
-        print(f"\n❌ Error processing email trigger: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Error processing email trigger: %s", e)
 
 
 def start_trigger_listener():
@@ -108,13 +170,32 @@ def start_trigger_listener():
     print("💡 The agent will automatically process any emails sent to the monitored inbox")
     print("⚡ Press Ctrl+C to stop\n")
 
+    # One long-lived loop for all triggers, so cached graphs and connection pools
+    # stay bound to the loop they were created on
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, name="trigger-event-loop", daemon=True)
+    loop_thread.start()
+
+    # Pre-warm singletons and create the schema before the first email arrives
+    print("🗄️ Initialising database schema...")
+    get_email_handler()
+    get_session_manager()
+    get_context_manager()
+    asyncio.run_coroutine_threadsafe(get_conversation_store().init_schema(), loop).result()
+
     listener = composio_client.triggers.subscribe()
     trigger_id = os.getenv('GMAIL_TRIGGER_ID')
 
+    # Triggers still running, so shutdown can wait for them
+    in_flight: set[concurrent.futures.Future] = set()
+
     @listener.handle(trigger_id=trigger_id)
     def callback_function(event):
-        print(f"🔔 Trigger received: {event.get('trigger_name', 'Unknown')}")
-        asyncio.run(process_email_trigger(event))
+        logger.info("🔔 Trigger received: %s", event.get('trigger_name', 'Unknown'))
+        # Hand the coroutine straight to the loop; no executor or ctx.run hop on this thread
+        future = asyncio.run_coroutine_threadsafe(process_email_trigger(event), loop)
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
 
     print("✅ Listener registered!")
     print("="*80 + "\n")
@@ -125,6 +206,52 @@ def start_trigger_listener():
             time.sleep(1)
     except KeyboardInterrupt:
         print("\n\n👋 Shutting down trigger listener...")
+    finally:
+        shutdown_trigger_loop(loop, loop_thread, in_flight)
+
+
+def shutdown_trigger_loop(
+    loop: asyncio.AbstractEventLoop,
+    loop_thread: threading.Thread,
+    in_flight: set[concurrent.futures.Future]
+):
+    """Let running triggers finish, commit queued conversation writes, then close the loop."""
+    _, still_running = concurrent.futures.wait(set(in_flight), timeout=SHUTDOWN_TIMEOUT_SECONDS)
+    if still_running:
+        logger.warning("⚠️ Cancelling %d unfinished trigger(s)", len(still_running))
+        for future in still_running:
+            future.cancel()
+
+    try:
+        asyncio.run_coroutine_threadsafe(
+            get_conversation_store().close(), loop
+        ).result(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.error("❌ Failed to flush conversation writes on shutdown: %s", e)
+
+    try:
+        asyncio.run_coroutine_threadsafe(
+            _cancel_remaining_tasks(), loop
+        ).result(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.error("❌ Failed to cancel remaining tasks on shutdown: %s", e)
+
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+    if loop_thread.is_alive():
+        logger.error("❌ Trigger loop did not stop; exiting without closing it")
+        return
+
+    loop.run_until_complete(loop.shutdown_default_executor())
+    loop.close()
+
+
+async def _cancel_remaining_tasks():
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def main_interactive():
@@ -161,15 +288,19 @@ def main():
     """Main function - choose to run trigger listener or interactive mode."""
     import sys
 
-    if len(sys.argv) > 1 and sys.argv[1] == "listen":
-        start_trigger_listener()
-    else:
-        print("Composio Email Assistant")
-        print("Usage:")
-        print("  python agent.py listen    - Start listening to email triggers")
-        print("  python agent.py           - Interactive mode (for testing)")
-        print()
-        asyncio.run(main_interactive())
+    log_listener = configure_logging()
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "listen":
+            start_trigger_listener()
+        else:
+            print("Composio Email Assistant")
+            print("Usage:")
+            print("  python agent.py listen    - Start listening to email triggers")
+            print("  python agent.py           - Interactive mode (for testing)")
+            print()
+            asyncio.run(main_interactive())
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
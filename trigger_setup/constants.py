@@ -1,13 +1,17 @@
 from composio import Composio
 from langchain_openai import ChatOpenAI
+from functools import cache
 import os
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Memoized so every module shares one client and its HTTP connection pool
+@cache
 def initialise_composio_client():
     return Composio(api_key=os.getenv("COMPOSIO_API_KEY"))
 
+@cache
 def initialise_chatmodel():
     return ChatOpenAI(model="gpt-5", api_key=os.getenv("OPENAI_API_KEY"))
\ No newline at end of file
@@ -8,6 +8,7 @@ Handles smart loading of conversation context to avoid token limits:
 """
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
+from functools import cache
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
 from database import get_conversation_store
 
@@ -33,7 +34,7 @@ class ContextManager:
         self.drop_after_days = drop_after_days
         self.db = get_conversation_store()
 
-    def load_conversation_context(
+    async def load_conversation_context(
         self,
         user_id: str,
         thread_id: str
@@ -44,66 +45,65 @@ class ContextManager:
         Returns:
             List of LangChain messages ready for the agent
         """
-        # Get conversation from database
-        conversation = self.db.get_conversation(user_id, thread_id)
+        # Apply sliding window in the database: fetch only the last N messages
+        conversation = await self.db.get_conversation_tail(
+            user_id, thread_id, self.recent_window_size
+        )
 
         if not conversation:
             # New conversation
             return []
 
-        # Get all message history
-        all_messages = conversation['message_history']
-
-        if len(all_messages) <= self.recent_window_size:
-            # Short conversation, return everything
-            return self._deserialize_messages(all_messages)
-
-        # Apply sliding window: keep last N messages
-        recent_messages = all_messages[-self.recent_window_size:]
-
         # TODO: Add summarization for older messages
         # For now, just use recent window
 
-        return self._deserialize_messages(recent_messages)
+        return self._deserialize_messages(conversation['message_history'])
 
-    def save_conversation_context(
+    async def save_conversation_context(
         self,
         user_id: str,
         thread_id: str,
         sender_email: str,
-        messages: List[BaseMessage],
+        new_messages: List[BaseMessage],
         pending_action: Optional[str] = None
     ):
         """
-        Save updated conversation context to database.
+        Append new messages to the conversation in the database.
 
         Args:
             user_id: User's email (sender)
             thread_id: Gmail thread ID
             sender_email: Email address of sender
-            messages: Updated full message history
+            new_messages: Messages produced this turn (not the loaded history)
             pending_action: Optional state tracking
         """
         # Serialize messages to dict format
-        message_dicts = self._serialize_messages(messages)
+        message_dicts = self._serialize_messages(new_messages)
 
-        # Save to database
-        self.db.save_conversation(
+        # Append to database, group-committed with other concurrent saves
+        await self.db.enqueue_append_messages(
             user_id=user_id,
             thread_id=thread_id,
             sender_email=sender_email,
-            message_history=message_dicts,
+            new_messages=message_dicts,
             pending_action=pending_action
         )
 
     def _serialize_messages(self, messages: List[BaseMessage]) -> List[Dict[str, Any]]:
-        """Convert LangChain messages to dict format for storage."""
+        """
+        Convert LangChain messages to dict format for storage.
+
+        Only called for messages new this turn, so they all share one timestamp.
+        """
+        # Encoded by the store's orjson serializer
+        now = datetime.utcnow()
+
         serialized = []
         for msg in messages:
             msg_dict = {
                 "type": msg.__class__.__name__,
                 "content": msg.content,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now
             }
 
             # Preserve additional fields
@@ -134,18 +134,18 @@ class ContextManager:
 
         return messages
 
-    def get_pending_action(self, user_id: str, thread_id: str) -> Optional[str]:
+    async def get_pending_action(self, user_id: str, thread_id: str) -> Optional[str]:
         """Get pending action for a conversation (e.g., 'awaiting_connection')."""
-        conversation = self.db.get_conversation(user_id, thread_id)
+        conversation = await self.db.get_conversation(user_id, thread_id)
         if conversation:
             return conversation.get('pending_action')
         return None
 
-    def clear_pending_action(self, user_id: str, thread_id: str):
+    async def clear_pending_action(self, user_id: str, thread_id: str):
         """Clear pending action after it's been resolved."""
-        conversation = self.db.get_conversation(user_id, thread_id)
+        conversation = await self.db.get_conversation(user_id, thread_id)
         if conversation:
-            self.db.save_conversation(
+            await self.db.save_conversation(
                 user_id=user_id,
                 thread_id=thread_id,
                 sender_email=conversation['sender_email'],
@@ -154,13 +154,7 @@ class ContextManager:
             )
 
 
-# Global instance
-_context_manager: Optional[ContextManager] = None
-
-
+@cache
 def get_context_manager() -> ContextManager:
     """Get or create the global context manager."""
-    global _context_manager
-    if _context_manager is None:
-        _context_manager = ContextManager()
-    return _context_manager
+    return ContextManager()
@@ -1,7 +1,21 @@
+import logging
 import os
+import re
+from functools import cache
 from typing import Dict, Any
 from constants import initialise_composio_client
 
+logger = logging.getLogger(__name__)
+
+# Address part of a "Name <user@example.com>" header
+_ADDR_RE = re.compile(r'<([^>]+)>')
+
+
+def parse_sender_email(sender_full: str) -> str:
+    """Extract the email address from a sender header value."""
+    match = _ADDR_RE.search(sender_full)
+    return match.group(1) if match else (sender_full or "unknown@email.com")
+
 
 class EmailHandler:
     """Handles email parsing and reply operations."""
@@ -13,11 +27,7 @@ class EmailHandler:
         """Parse Composio email trigger payload."""
         payload = trigger_data.get("payload", {})
 
-        sender_full = payload.get("sender", "")
-        if "<" in sender_full and ">" in sender_full:
-            sender_email = sender_full.split("<")[1].split(">")[0]
-        else:
-            sender_email = sender_full or "unknown@email.com"
+        sender_email = parse_sender_email(payload.get("sender", ""))
 
         metadata = trigger_data.get("metadata", {})
         connected_account = metadata.get("connected_account", {})
@@ -34,7 +44,7 @@ class EmailHandler:
 
     def send_reply(self, connected_account_id: str, thread_id: str, recipient_email: str, message_body: str) -> Dict[str, Any]:
         """Send a reply to an email thread."""
-        print(f"📧 Sending reply to {recipient_email}")
+        logger.info("📧 Sending reply to %s", recipient_email)
 
         result = self.composio_client.tools.execute(
             "GMAIL_REPLY_TO_THREAD",
@@ -47,15 +57,10 @@ class EmailHandler:
                 "user_id": "me"
             }
         )
-        print(f"✅ Reply sent successfully!")
+        logger.info("✅ Reply sent successfully!")
         return result
 
 
-_email_handler = None
-
-
+@cache
 def get_email_handler() -> EmailHandler:
-    global _email_handler
-    if _email_handler is None:
-        _email_handler = EmailHandler()
-    return _email_handler
+    return EmailHandler()
@@ -1,40 +1,28 @@
-from typing import Dict, Any
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from functools import cache
+import httpx
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable, TypeVar
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langgraph.prebuilt import create_react_agent
+from langgraph.prebuilt import ToolNode, create_react_agent
+from langgraph.prebuilt.tool_node import TOOL_CALL_ERROR_TEMPLATE
 from constants import initialise_composio_client, initialise_chatmodel
+from utils import run_blocking
 
 
-class SessionManager:
-    """Manages Composio Tool Router sessions and LangGraph agent."""
-
-    def __init__(self):
-        self.composio_client = initialise_composio_client()
-        self.llm = initialise_chatmodel()
-
-    async def create_session_and_graph(self, user_id: str) -> Dict[str, Any]:
-        """Create Tool Router session and agent for user."""
-        print(f"🔧 Creating Tool Router session for: {user_id}")
-
-        session = self.composio_client.create(user_id=user_id)
-
-        mcp_url = session.mcp.url
-        mcp_headers = session.mcp.headers
-        print(f"✅ Session URL: {mcp_url[:60]}...")
-
-        graph = await self._build_graph(mcp_url, mcp_headers)
-
-        return {'session': session, 'mcp_url': mcp_url, 'graph': graph}
+# Cached sessions idle for longer than this are dropped; every hit slides the deadline
+GRAPH_CACHE_IDLE_TTL_SECONDS = 30 * 60
+# Hard cap from creation, however often the entry is hit, so a session is never used past its lifetime
+GRAPH_CACHE_MAX_AGE_SECONDS = 30 * 60
+GRAPH_CACHE_MAX_ENTRIES = 256
 
-    async def _build_graph(self, mcp_url: str, mcp_headers: dict = None):
-        """Build LangGraph agent with MCP tools."""
-        mcp_client = MultiServerMCPClient({
-            "composio": {"url": mcp_url, "transport": "streamable_http", "headers": mcp_headers or {}}
-        })
+T = TypeVar('T')
 
-        tools = await mcp_client.get_tools()
-        print(f"🔨 Loaded {len(tools)} tools from Tool Router")
+logger = logging.getLogger(__name__)
 
-        system_prompt = """You are an intelligent email assistant. You receive emails and execute instructions.
+SYSTEM_PROMPT = """You are an intelligent email assistant. You receive emails and execute instructions.
 
 **INSTRUCTIONS:**
 1. Analyze each email content carefully
@@ -58,15 +46,172 @@ class SessionManager:
 The tool router will automatically discover, authenticate, and execute the right tools across 500+ apps.
 Be helpful, efficient, and professional."""
 
-        agent = create_react_agent(self.llm, tools, prompt=system_prompt)
-        return agent
+
+def _is_session_rejected(error: BaseException, mcp_url: str) -> bool:
+    """
+    Check whether an error (or anything it wraps) is the MCP transport's
+    request to this session's URL failing with 401/403.
+    """
+    session_url = httpx.URL(mcp_url)
+    pending = [error]
+    seen = set()
+    while pending:
+        exc = pending.pop()
+        if exc is None or id(exc) in seen:
+            continue
+        seen.add(id(exc))
+
+        if (
+            isinstance(exc, httpx.HTTPStatusError)
+            and exc.response.status_code in (401, 403)
+            and exc.request.url == session_url
+        ):
+            return True
+
+        pending.extend(getattr(exc, 'exceptions', ()))
+        pending.append(exc.__cause__)
+        pending.append(exc.__context__)
+    return False
+
+
+def _tool_error_handler(mcp_url: str) -> Callable[[Exception], str]:
+    """
+    Build a ToolNode error handler that reports tool failures back to the model,
+    except a rejected session, which is re-raised so run_with_graph can rebuild it.
+    """
+    def handle(error: Exception) -> str:
+        if _is_session_rejected(error, mcp_url):
+            raise error
+        return TOOL_CALL_ERROR_TEMPLATE.format(error=repr(error))
+
+    return handle
+
+
+class RunProgress:
+    """Records side effects of an agent run, so a failed run is only retried before any happen."""
+
+    def __init__(self):
+        self.tool_calls_completed = 0
 
 
-_session_manager = None
+class SessionManager:
+    """Manages Composio Tool Router sessions and LangGraph agent."""
+
+    def __init__(self):
+        self.composio_client = initialise_composio_client()
+        self.llm = initialise_chatmodel()
+        # user_id -> (created_at, expires_at, {session, mcp_url, graph, mcp_client}), least recently used first
+        self._graph_cache: "OrderedDict[str, Tuple[float, float, Dict[str, Any]]]" = OrderedDict()
+        # user_id -> in-flight build, so concurrent misses for one user share a session
+        self._pending_builds: Dict[str, asyncio.Task] = {}
+
+    async def create_session_and_graph(self, user_id: str) -> Dict[str, Any]:
+        """Return the cached session and agent for user, creating them on a miss."""
+        cached = self._get_cached(user_id)
+        if cached is not None:
+            logger.info("♻️ Reusing cached Tool Router session for: %s", user_id)
+            return cached
+
+        build = self._pending_builds.get(user_id)
+        if build is None:
+            build = asyncio.get_running_loop().create_task(self._build_and_store(user_id))
+            self._pending_builds[user_id] = build
+            build.add_done_callback(lambda _: self._pending_builds.pop(user_id, None))
+
+        # Shielded so one waiter being cancelled doesn't abort the build for the others
+        return await asyncio.shield(build)
+
+    async def _build_and_store(self, user_id: str) -> Dict[str, Any]:
+        session_data = await self._create_session_and_graph(user_id)
+        self._store(user_id, session_data)
+        return session_data
+
+    async def run_with_graph(
+        self,
+        user_id: str,
+        run: Callable[[Any, RunProgress], Awaitable[T]]
+    ) -> T:
+        """
+        Run `run(graph, progress)` with the user's cached agent.
+
+        `run` must count finished tool calls on `progress`. The Tool Router
+        session is only rebuilt when the MCP transport gets a 401/403 from its
+        URL; `run` is then retried once, but only if no tool call had completed,
+        since replaying the run would repeat those side effects.
+        """
+        session_data = await self.create_session_and_graph(user_id)
+        progress = RunProgress()
+        try:
+            return await run(session_data['graph'], progress)
+        except Exception as e:
+            if not _is_session_rejected(e, session_data['mcp_url']):
+                raise
+            self.invalidate(user_id)
+            if progress.tool_calls_completed:
+                logger.warning("🔄 Tool Router session rejected after tool calls ran; not retrying")
+                raise
+            logger.warning("🔄 Tool Router session rejected (%s), rebuilding once...", e)
+
+        session_data = await self.create_session_and_graph(user_id)
+        return await run(session_data['graph'], RunProgress())
+
+    def invalidate(self, user_id: str):
+        """Drop the cached session and agent for user so the next call rebuilds them."""
+        self._graph_cache.pop(user_id, None)
+
+    def _get_cached(self, user_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._graph_cache.get(user_id)
+        if entry is None:
+            return None
+
+        created_at, expires_at, session_data = entry
+        now = time.monotonic()
+        if expires_at <= now or created_at + GRAPH_CACHE_MAX_AGE_SECONDS <= now:
+            self.invalidate(user_id)
+            return None
+
+        self._graph_cache[user_id] = (created_at, now + GRAPH_CACHE_IDLE_TTL_SECONDS, session_data)
+        self._graph_cache.move_to_end(user_id)
+        return session_data
+
+    def _store(self, user_id: str, session_data: Dict[str, Any]):
+        now = time.monotonic()
+        self._graph_cache[user_id] = (now, now + GRAPH_CACHE_IDLE_TTL_SECONDS, session_data)
+        self._graph_cache.move_to_end(user_id)
+
+        while len(self._graph_cache) > GRAPH_CACHE_MAX_ENTRIES:
+            self.invalidate(next(iter(self._graph_cache)))
+
+    async def _create_session_and_graph(self, user_id: str) -> Dict[str, Any]:
+        """Create Tool Router session and agent for user."""
+        logger.info("🔧 Creating Tool Router session for: %s", user_id)
+
+        # Blocking HTTP call; keep it off the shared trigger loop
+        session = await run_blocking(self.composio_client.create, user_id=user_id)
+
+        mcp_url = session.mcp.url
+        mcp_headers = session.mcp.headers
+        logger.info("✅ Session URL: %s...", mcp_url[:60])
+
+        mcp_client = MultiServerMCPClient({
+            "composio": {"url": mcp_url, "transport": "streamable_http", "headers": mcp_headers or {}}
+        })
+        graph = await self._build_graph(mcp_client, mcp_url)
+
+        return {'session': session, 'mcp_url': mcp_url, 'graph': graph, 'mcp_client': mcp_client}
+
+    async def _build_graph(self, mcp_client: MultiServerMCPClient, mcp_url: str):
+        """Build LangGraph agent with MCP tools."""
+        tools = await mcp_client.get_tools()
+        logger.info("🔨 Loaded %d tools from Tool Router", len(tools))
+
+        # The default ToolNode turns every tool error into a message, which would
+        # hide a rejected session from run_with_graph
+        tool_node = ToolNode(tools, handle_tool_errors=_tool_error_handler(mcp_url))
+        agent = create_react_agent(self.llm, tool_node, prompt=SYSTEM_PROMPT)
+        return agent
 
 
+@cache
 def get_session_manager() -> SessionManager:
-    global _session_manager
-    if _session_manager is None:
-        _session_manager = SessionManager()
-    return _session_manager
+    return SessionManager()
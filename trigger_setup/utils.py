@@ -0,0 +1,18 @@
+import asyncio
+import contextvars
+import functools
+
+
+async def run_blocking(func, /, *args, **kwargs):
+    """
+    Run a blocking call in the default executor.
+
+    Like asyncio.to_thread, but the call is only wrapped in ctx.run when the
+    current context actually holds variables to carry over.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    ctx = contextvars.copy_context()
+    if ctx:
+        call = functools.partial(ctx.run, call)
+    return await loop.run_in_executor(None, call)